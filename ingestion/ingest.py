@@ -1,19 +1,42 @@
 #!/usr/bin/env python3
 """Ingest WorldPop GeoTIFF into PostgreSQL.
 
-Reads the raster row-by-row, maps each pixel to a canonical 30 arc-second
-cell_id (matching the Rust API and SQL function), and streams to PostgreSQL
-via COPY for maximum throughput.
+Reads the raster in block-aligned row bands, maps each pixel to a canonical
+30 arc-second cell_id (matching the Rust API and SQL function), and streams
+to PostgreSQL via binary COPY for maximum throughput. Row ranges are spread
+across a pool of worker processes, each running its own COPY on its own
+connection, into an UNLOGGED table that replaces population once loaded.
+Rasters that are not on the native 30 arc-second grid go through a staging
+table first so the server can dedup cells shared by several pixels.
 """
 
-import os, sys, time, io
+import os, sys, time, io, struct
+import multiprocessing as mp
 import numpy as np
 import rasterio
 import psycopg
 
 NCOLS = 43200   # 360° × 120
 NROWS = 21600   # 180° × 120
-BATCH_SIZE = 500_000
+# Rows per COPY flush. PostgreSQL COPY throughput plateaus at around 10k rows
+# per batch; larger batches only grow client buffers and server COPY state.
+BATCH_SIZE = max(1, int(os.environ.get("GEOPOP_COPY_BATCH", "20000")))
+READ_ROWS = 256  # rows per windowed read, rounded down to a multiple of shorter blocks
+TASK_ROWS = 1024  # source rows handed to a worker per task
+STAGE_TABLE = "population_stage"  # every pixel of a non-native raster, before dedup
+LOAD_TABLE = "population_load"  # UNLOGGED table swapped in as population once loaded
+WORKERS = int(os.environ.get("GEOPOP_INGEST_WORKERS", min(4, os.cpu_count() or 1)))
+GDAL_CACHE_MB = 1024  # GDAL block cache budget, split across the workers
+
+# PostgreSQL binary COPY framing for population (cell_id INTEGER, pop REAL).
+COPY_HEADER = b"PGCOPY\n\xff\r\n\0" + struct.pack(">ii", 0, 0)
+COPY_TRAILER = struct.pack(">h", -1)
+COPY_CHUNK = 64 * 1024  # bytes per copy.write() call
+COPY_ROW = np.dtype([
+    ("nfields", ">i2"),
+    ("cell_id_len", ">i4"), ("cell_id", ">i4"),
+    ("pop_len", ">i4"), ("pop", ">f4"),
+])
 
 
 def connect(db_url: str, retries: int = 30) -> psycopg.Connection:
@@ -48,96 +71,248 @@ def find_tif() -> str:
     sys.exit(1)
 
 
-def ingest(tif_path: str, db_url: str) -> None:
+def ingest(tif_path: str, db_url: str, workers: int = WORKERS) -> None:
     print(f"Opening raster: {tif_path}")
 
     with rasterio.open(tif_path) as src:
         nodata = src.nodata
         t = src.transform
-        print(f"Raster: {src.width}x{src.height}, CRS={src.crs}, NoData={nodata}")
-
-        row_lats = t.f + (np.arange(src.height) + 0.5) * t.e
-        canonical_rows = np.floor((90.0 - row_lats) * 120.0).astype(np.int64)
-
-        col_lons = t.c + (np.arange(src.width) + 0.5) * t.a
-        canonical_cols = np.floor((col_lons + 180.0) * 120.0).astype(np.int64)
-
-        conn = connect(db_url)
-        conn.autocommit = False
-
+        height, width = src.height, src.width
+        block_h = src.block_shapes[0][0]
+        print(f"Raster: {width}x{height}, CRS={src.crs}, NoData={nodata}")
+
+    canonical_rows, canonical_cols, exact = _canonical_lookups(t, height, width)
+
+    # Both lookups are monotonic, so the pixels that land inside the canonical
+    # grid form one contiguous window; everything outside it is never read.
+    rows_in = np.flatnonzero((canonical_rows >= 0) & (canonical_rows < NROWS))
+    cols_in = np.flatnonzero((canonical_cols >= 0) & (canonical_cols < NCOLS))
+    if len(rows_in) == 0 or len(cols_in) == 0:
+        print("ERROR: Raster does not overlap the canonical grid.")
+        sys.exit(1)
+    y_lo, y_hi = int(rows_in[0]), int(rows_in[-1]) + 1
+    x_lo, x_hi = int(cols_in[0]), int(cols_in[-1]) + 1
+
+    # Single-strip or tall-strip files can report block_h up to the full
+    # height; cap the band so one read never spans the whole raster.
+    step = block_h * max(1, READ_ROWS // block_h) if block_h <= READ_ROWS else READ_ROWS
+    rows_per_task = step * max(1, TASK_ROWS // step)
+    tasks = [
+        (max(y0, y_lo), min(y0 + rows_per_task, y_hi))
+        for y0 in range(y_lo - y_lo % rows_per_task, y_hi, rows_per_task)
+    ]
+
+    conn = connect(db_url)
+    conn.autocommit = False
+
+    # COPY into a fresh UNLOGGED table without indexes so the load avoids
+    # per-row WAL and index maintenance. A native 30 arc-second raster maps one pixel to
+    # one cell and loads straight into the table that replaces population;
+    # otherwise several pixels may share a cell and go through a stage that
+    # the server dedups.
+    copy_table = LOAD_TABLE if exact else STAGE_TABLE
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {STAGE_TABLE}, {LOAD_TABLE}")
+        cur.execute(f"CREATE UNLOGGED TABLE {copy_table} (LIKE population INCLUDING DEFAULTS)")
+    conn.commit()
+    print(f"Created load table {copy_table}.")
+
+    workers = max(1, min(workers, len(tasks)))
+    print(f"Ingesting {len(tasks)} row ranges with {workers} worker(s)...")
+
+    total = done_rows = 0
+    start = time.time()
+    # Each band read spans a full row of blocks, so every block is decoded once
+    # as long as the cache holds one band. Cache and GDAL decode threads are
+    # divided between the worker processes so they don't oversubscribe.
+    gdal_env = {
+        "GDAL_CACHEMAX": max(64, GDAL_CACHE_MB // workers),
+        "GDAL_NUM_THREADS": max(1, (os.cpu_count() or 1) // workers),
+        "GTIFF_DIRECT_IO": "YES",
+    }
+    init_args = (
+        tif_path, db_url, gdal_env, copy_table,
+        canonical_rows, canonical_cols[x_lo:x_hi], x_lo, step,
+    )
+
+    with mp.Pool(workers, initializer=_init_worker, initargs=init_args) as pool:
+        for y0, y1, rows in pool.imap_unordered(_ingest_rows, tasks):
+            total += rows
+            done_rows += y1 - y0
+
+            elapsed = time.time() - start
+            pct = done_rows / (y_hi - y_lo) * 100
+            rate = total / elapsed if elapsed > 0 else 0
+            print(f"  Rows {y0}-{y1} done, {done_rows}/{y_hi - y_lo} ({pct:.1f}%) — {total:,} rows — {rate:,.0f}/s")
+
+        pool.close()
+        pool.join()
+
+    elapsed = time.time() - start
+    print(f"\nCopied: {total:,} rows in {elapsed:.1f}s ({total/elapsed:,.0f}/s)")
+
+    loaded = total
+    if not exact:
+        print("Deduplicating staged cells...")
         with conn.cursor() as cur:
-            cur.execute("TRUNCATE population")
+            cur.execute(f"CREATE UNLOGGED TABLE {LOAD_TABLE} (LIKE population INCLUDING DEFAULTS)")
+            cur.execute(
+                f"INSERT INTO {LOAD_TABLE} (cell_id, pop) "
+                f"SELECT cell_id, max(pop) FROM {STAGE_TABLE} GROUP BY cell_id"
+            )
+            loaded = cur.rowcount
+            cur.execute(f"DROP TABLE {STAGE_TABLE}")
         conn.commit()
-        print("Truncated population table.")
-
-        total = skipped_oob = skipped_dup = 0
-        start = time.time()
-        buf = io.StringIO()
-        buf_count = 0
-        seen = set()
-
-        for row_idx in range(src.height):
-            crow = canonical_rows[row_idx]
-            if crow < 0 or crow >= NROWS:
-                skipped_oob += 1
-                continue
-
-            data = src.read(1, window=rasterio.windows.Window(0, row_idx, src.width, 1)).flatten()
-            mask = (data > 0) & np.isfinite(data)
-            if nodata is not None:
-                mask &= data != nodata
-
-            valid_cols = np.where(mask)[0]
-            if len(valid_cols) == 0:
-                continue
-
-            for ccol, pop_val in zip(canonical_cols[valid_cols], data[valid_cols]):
-                if ccol < 0 or ccol >= NCOLS:
-                    skipped_oob += 1
-                    continue
-
-                cell_id = int(crow) * NCOLS + int(ccol)
-                if cell_id in seen:
-                    skipped_dup += 1
-                    continue
-                seen.add(cell_id)
-
-                buf.write(f"{cell_id}\t{pop_val:.6g}\n")
-                buf_count += 1
+    print(f"Done: {loaded:,} cells")
+    print(f"Skipped: {total - loaded:,} duplicates; "
+          f"{height - (y_hi - y_lo):,} rows and {width - (x_hi - x_lo):,} columns outside the grid")
+
+    # SET LOGGED rewrites the table (WAL-logging it in one pass unless
+    # wal_level=minimal) and rebuilds every index, so it runs while the table
+    # has none and the primary key is built exactly once.
+    print("Building primary key and swapping in the new population table...")
+    with conn.cursor() as cur:
+        cur.execute(f"ALTER TABLE {LOAD_TABLE} SET LOGGED")
+        cur.execute(f"ALTER TABLE {LOAD_TABLE} ADD PRIMARY KEY (cell_id)")
+    conn.commit()
+    with conn.transaction(), conn.cursor() as cur:
+        cur.execute("DROP TABLE population")
+        cur.execute(f"ALTER TABLE {LOAD_TABLE} RENAME TO population")
+        cur.execute(f"ALTER INDEX {LOAD_TABLE}_pkey RENAME TO population_pkey")
+
+    print("Running VACUUM ANALYZE...")
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("VACUUM ANALYZE population")
+    conn.close()
+    print("Complete.")
+
+
+def _canonical_lookups(t, height: int, width: int) -> tuple[np.ndarray, np.ndarray, bool]:
+    """Map each source row/col to its canonical grid row/col.
+
+    Returns (canonical_rows, canonical_cols, exact). For an unrotated raster
+    with 30 arc-second pixels, floor(offset + i + 0.5) reduces to a constant
+    plus i, so the lookups are pure integer ranges and exact is True: every
+    source pixel lands in its own canonical cell.
+    """
+    if t.b == 0 and t.d == 0 and abs(t.a - 1 / 120) < 1e-10 and abs(t.e + 1 / 120) < 1e-10:
+        row0 = int(np.floor((90.0 - t.f) * 120.0 + 0.5))
+        col0 = int(np.floor((t.c + 180.0) * 120.0 + 0.5))
+        return row0 + np.arange(height, dtype=np.int64), col0 + np.arange(width, dtype=np.int64), True
+
+    row_lats = t.f + (np.arange(height) + 0.5) * t.e
+    canonical_rows = np.floor((90.0 - row_lats) * 120.0).astype(np.int64)
+
+    col_lons = t.c + (np.arange(width) + 0.5) * t.a
+    canonical_cols = np.floor((col_lons + 180.0) * 120.0).astype(np.int64)
+    return canonical_rows, canonical_cols, False
+
+
+# Per-process state set up by _init_worker: raster handle, DB connection,
+# and the canonical row/col lookups shared by every task in the pool. Each
+# worker keeps its one connection for its whole lifetime, so there is no
+# per-task reconnect for a client-side connection pool to save.
+# canonical_cols covers only the in-grid source columns starting at col_off.
+_worker = {}
+
+
+def _init_worker(tif_path, db_url, gdal_env, table, canonical_rows, canonical_cols, col_off, step) -> None:
+    conn = connect(db_url)
+    conn.autocommit = False
+    env = rasterio.Env(**gdal_env)
+    env.__enter__()
+    src = rasterio.open(tif_path)
+    mp.util.Finalize(None, conn.close, exitpriority=10)
+    mp.util.Finalize(None, src.close, exitpriority=10)
+    mp.util.Finalize(None, env.__exit__, args=(None, None, None), exitpriority=5)
+    _worker.update(
+        src=src, conn=conn, table=table, step=step,
+        canonical_rows=canonical_rows, canonical_cols=canonical_cols, col_off=col_off,
+    )
+
+
+def _ingest_rows(task: tuple[int, int]) -> tuple[int, int, int]:
+    """COPY populated pixels of source rows [y0, y1) into the worker's load table.
+
+    Returns (y0, y1, rows written).
+    """
+    y_start, y_end = task
+    src, conn, table, step = _worker["src"], _worker["conn"], _worker["table"], _worker["step"]
+    canonical_rows, canonical_cols = _worker["canonical_rows"], _worker["canonical_cols"]
+    col_off, width = _worker["col_off"], len(canonical_cols)
+
+    # data > 0 already rejects NaN and any NoData value <= 0, so only the
+    # remaining cases need an extra pass: +inf in float rasters, positive NoData.
+    needs_finite = np.issubdtype(np.dtype(src.dtypes[0]), np.floating)
+    nodata = src.nodata if src.nodata is not None and src.nodata > 0 else None
+
+    total = 0
+    buf = io.BytesIO()
+    buf_count = 0
+
+    # Empty (ocean/ice) bands are not pre-screened: a decimated "alive map" read
+    # still decodes every source block and measured 2-5x slower than this full
+    # block-aligned pass, and overviews built with nearest resampling can miss
+    # populated cells. Empty bands fall through at the flatnonzero check below.
+    for y0 in range(y_start, y_end, step):
+        h = min(step, y_end - y0)
+        data = src.read(1, window=rasterio.windows.Window(col_off, y0, width, h))
+
+        mask = data > 0
+        if needs_finite:
+            mask &= np.isfinite(data)
+        if nodata is not None:
+            mask &= data != nodata
+
+        valid = np.flatnonzero(mask)
+        if len(valid) > 0:
+            r, c = np.divmod(valid, width)
+            cell_ids = canonical_rows[y0 + r] * NCOLS + canonical_cols[c]
+            pops = data.ravel()[valid]
+
+            # A dense band can hold millions of cells; split it across flushes
+            # so no single COPY exceeds BATCH_SIZE rows.
+            pos = 0
+            while pos < len(cell_ids):
+                end = min(pos + BATCH_SIZE - buf_count, len(cell_ids))
+                buf.write(_encode_rows(cell_ids[pos:end], pops[pos:end]))
+                buf_count += end - pos
+                pos = end
 
                 if buf_count >= BATCH_SIZE:
-                    _flush(conn, buf, buf_count)
+                    _flush(conn, table, buf)
                     total += buf_count
-                    buf, buf_count = io.StringIO(), 0
+                    buf, buf_count = io.BytesIO(), 0
 
-            if (row_idx + 1) % 1000 == 0:
-                elapsed = time.time() - start
-                pct = (row_idx + 1) / src.height * 100
-                rate = total / elapsed if elapsed > 0 else 0
-                print(f"  Row {row_idx+1}/{src.height} ({pct:.1f}%) — {total:,} rows — {rate:,.0f}/s")
+    if buf_count > 0:
+        _flush(conn, table, buf)
+        total += buf_count
 
-        if buf_count > 0:
-            _flush(conn, buf, buf_count)
-            total += buf_count
+    # One commit per task rather than per flush: the load table is discarded
+    # on failure anyway, so intermediate commits buy no durability.
+    conn.commit()
+    return y_start, y_end, total
 
-        elapsed = time.time() - start
-        print(f"\nDone: {total:,} rows in {elapsed:.1f}s ({total/elapsed:,.0f}/s)")
-        print(f"Skipped: {skipped_oob:,} out-of-bounds, {skipped_dup:,} duplicates")
 
-        print("Running VACUUM ANALYZE...")
-        conn.autocommit = True
-        with conn.cursor() as cur:
-            cur.execute("VACUUM ANALYZE population")
-        conn.close()
-        print("Complete.")
+def _encode_rows(cell_ids: np.ndarray, pops: np.ndarray) -> bytes:
+    rows = np.empty(len(cell_ids), dtype=COPY_ROW)
+    rows["nfields"] = 2
+    rows["cell_id_len"] = 4
+    rows["cell_id"] = cell_ids
+    rows["pop_len"] = 4
+    rows["pop"] = pops
+    return rows.tobytes()
 
 
-def _flush(conn, buf: io.StringIO, count: int) -> None:
-    buf.seek(0)
+def _flush(conn, table: str, buf: io.BytesIO) -> None:
     with conn.cursor() as cur:
-        with cur.copy("COPY population (cell_id, pop) FROM STDIN") as copy:
-            copy.write(buf.read())
-    conn.commit()
+        with cur.copy(f"COPY {table} (cell_id, pop) FROM STDIN WITH (FORMAT BINARY)") as copy:
+            copy.write(COPY_HEADER)
+            buf.seek(0)
+            while chunk := buf.read(COPY_CHUNK):
+                copy.write(chunk)
+            copy.write(COPY_TRAILER)
 
 
 if __name__ == "__main__":
@@ -7,10 +7,16 @@ Loads:
 - allCountries.zip     → geonames (filtered to feature_class='P' populated places)
 """
 
-import os, sys, time, io, zipfile
+import os, sys, time, struct, zipfile
+from itertools import islice
 import psycopg
 
-BATCH_SIZE = 100_000
+# Rows per COPY batch; PostgreSQL COPY throughput plateaus at around 10k rows.
+BATCH_SIZE = max(1, int(os.environ.get("GEOPOP_COPY_BATCH", "20000")))
+
+# Wire types for the binary COPY into geonames. geom is sent as raw EWKB
+# bytes, which the geometry column's binary input parses directly.
+GEONAMES_TYPES = ["int4", "text", "float8", "float8", "text", "text", "text", "text", "int8", "bytea"]
 
 
 def connect(db_url: str, retries: int = 30) -> psycopg.Connection:
@@ -41,27 +47,22 @@ def _load_tsv(conn, path: str, table: str, columns: str) -> int:
         print(f"  WARNING: {path} not found, skipping")
         return 0
 
-    buf = io.StringIO()
     count = 0
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            if line.startswith("#"):
-                continue
-            parts = line.strip().split("\t")
-            if len(parts) < 2:
-                continue
-            code, name = parts[0].strip(), parts[1].strip()
-            if not code or not name:
-                continue
-            buf.write(f"{code}\t{name.replace(chr(9), ' ').replace(chr(10), ' ')}\n")
-            count += 1
-
-    buf.seek(0)
-    with conn.cursor() as cur:
+    with open(path, "r", encoding="utf-8") as f, conn.cursor() as cur:
         cur.execute(f"TRUNCATE {table}")
         with cur.copy(f"COPY {table} ({columns}) FROM STDIN") as copy:
-            copy.write(buf.read())
-    conn.commit()
+            for line in f:
+                if line.startswith("#"):
+                    continue
+                parts = line.strip().split("\t")
+                if len(parts) < 2:
+                    continue
+                code, name = parts[0].strip(), parts[1].strip()
+                if not code or not name:
+                    continue
+                copy.write_row((code, name))
+                count += 1
+
     print(f"  {table}: {count:,} rows")
     return count
 
@@ -74,64 +75,68 @@ def _load_geonames(conn, zip_path: str) -> int:
 
     with conn.cursor() as cur:
         cur.execute("TRUNCATE geonames")
-    conn.commit()
 
     total = 0
     start = time.time()
     copy_sql = (
         "COPY geonames (geonameid, name, latitude, longitude, "
         "feature_code, country_code, admin1_code, admin2_code, "
-        "population, geom) FROM STDIN"
+        "population, geom) FROM STDIN WITH (FORMAT BINARY)"
     )
 
     with zipfile.ZipFile(zip_path) as zf, zf.open("allCountries.txt") as raw:
-        buf = io.StringIO()
-        buf_count = 0
-
-        for line_bytes in raw:
-            parts = line_bytes.decode("utf-8", errors="replace").split("\t")
-            if len(parts) < 19 or parts[6].strip() != "P":
-                continue
-
-            gid = parts[0].strip()
-            lat, lon = parts[4].strip(), parts[5].strip()
-            if not gid or not lat or not lon:
-                continue
-
-            name = parts[1].strip().replace("\t", " ").replace("\n", " ")
-            pop = parts[14].strip() or "0"
-
-            buf.write(
-                f"{gid}\t{name}\t{lat}\t{lon}\t"
-                f"{parts[7].strip()}\t{parts[8].strip()}\t{parts[10].strip()}\t{parts[11].strip()}\t"
-                f"{pop}\tSRID=4326;POINT({lon} {lat})\n"
-            )
-            buf_count += 1
-
-            if buf_count >= BATCH_SIZE:
-                buf.seek(0)
-                with conn.cursor() as cur:
-                    with cur.copy(copy_sql) as copy:
-                        copy.write(buf.read())
-                conn.commit()
-                total += buf_count
+        places = _iter_places(raw)
+        while batch := list(islice(places, BATCH_SIZE)):
+            with conn.cursor() as cur, cur.copy(copy_sql) as copy:
+                copy.set_types(GEONAMES_TYPES)
+                for row in batch:
+                    copy.write_row(row)
+            total += len(batch)
+            if len(batch) == BATCH_SIZE:
                 rate = total / (time.time() - start)
                 print(f"    {total:,} rows ({rate:,.0f}/s)")
-                buf, buf_count = io.StringIO(), 0
-
-        if buf_count > 0:
-            buf.seek(0)
-            with conn.cursor() as cur:
-                with cur.copy(copy_sql) as copy:
-                    copy.write(buf.read())
-            conn.commit()
-            total += buf_count
 
     elapsed = time.time() - start
     print(f"  geonames: {total:,} rows in {elapsed:.1f}s")
     return total
 
 
+def _iter_places(raw):
+    """Yield geonames rows for populated places (feature class P) in allCountries.txt."""
+    # Split raw bytes and decode only the text fields that are kept; int() and
+    # float() parse ASCII bytes directly. Most lines are not populated places,
+    # so the feature class is checked on a split that stops after column 7.
+    for line_bytes in raw:
+        head = line_bytes.split(b"\t", 7)
+        if len(head) < 8 or head[6].strip() != b"P":
+            continue
+
+        parts = line_bytes.split(b"\t")
+        if len(parts) < 19:
+            continue
+
+        gid = parts[0].strip()
+        lat, lon = parts[4].strip(), parts[5].strip()
+        if not gid or not lat or not lon:
+            continue
+
+        try:
+            gid, lat, lon = int(gid), float(lat), float(lon)
+            pop = int(parts[14].strip() or 0)
+        except ValueError:
+            continue
+
+        name, fcode, ccode, a1, a2 = (
+            parts[i].strip().decode("utf-8", errors="replace") for i in (1, 7, 8, 10, 11)
+        )
+        yield gid, name, lat, lon, fcode, ccode, a1, a2, pop, _point_ewkb(lon, lat)
+
+
+def _point_ewkb(lon: float, lat: float) -> bytes:
+    """Little-endian EWKB for POINT(lon lat) with SRID 4326."""
+    return struct.pack("<BIIdd", 1, 0x20000001, 4326, lon, lat)
+
+
 def main():
     db_url = get_db_url()
     data_dir = os.path.join(os.path.dirname(__file__), "..", "data", "geonames")
@@ -144,18 +149,20 @@ def main():
     conn = connect(db_url)
     conn.autocommit = False
 
-    print("Loading lookup tables...")
-    _load_tsv(conn, os.path.join(data_dir, "admin1CodesASCII.txt"), "admin1_codes", "code, name")
-    _load_tsv(conn, os.path.join(data_dir, "admin2Codes.txt"), "admin2_codes", "code, name")
+    # All three tables are replaced in one transaction, so a failed load
+    # leaves the previous data in place instead of a half-loaded database.
+    with conn.transaction():
+        print("Loading lookup tables...")
+        _load_tsv(conn, os.path.join(data_dir, "admin1CodesASCII.txt"), "admin1_codes", "code, name")
+        _load_tsv(conn, os.path.join(data_dir, "admin2Codes.txt"), "admin2_codes", "code, name")
 
-    print("\nLoading populated places...")
-    _load_geonames(conn, os.path.join(data_dir, "allCountries.zip"))
+        print("\nLoading populated places...")
+        _load_geonames(conn, os.path.join(data_dir, "allCountries.zip"))
 
     print("\nRunning VACUUM ANALYZE...")
     conn.autocommit = True
     with conn.cursor() as cur:
-        for t in ("admin1_codes", "admin2_codes", "geonames"):
-            cur.execute(f"VACUUM ANALYZE {t}")
+        cur.execute("VACUUM (ANALYZE) admin1_codes, admin2_codes, geonames")
     conn.close()
     print("Complete.")
 
@@ -8,6 +8,7 @@ and MultiPolygon geometries into the countries table.
 import os, sys, time
 import fiona
 import psycopg
+from shapely import wkb
 from shapely.geometry import shape, MultiPolygon
 
 
@@ -46,65 +47,61 @@ def ingest(shp_path: str, db_url: str) -> None:
     conn = connect(db_url)
     conn.autocommit = False
 
-    with conn.cursor() as cur:
-        cur.execute("TRUNCATE countries RESTART IDENTITY CASCADE")
-    conn.commit()
-
     count = skipped = 0
-    insert_sql = """
-        INSERT INTO countries (iso_a2, iso_a3, name, formal_name,
-            continent, region_un, subregion, type, sovereign, pop_est, geom)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, ST_GeomFromEWKT(%s))
-    """
-
-    with fiona.open(shp_path) as src:
+    copy_sql = (
+        "COPY countries (iso_a2, iso_a3, name, formal_name, continent, "
+        "region_un, subregion, type, sovereign, pop_est, geom) FROM STDIN"
+    )
+
+    # One cursor and one transaction for the whole load: a failure part-way
+    # rolls back the TRUNCATE too instead of leaving a half-filled table.
+    with fiona.open(shp_path) as src, conn.cursor() as cur:
         print(f"Features: {len(src)}, CRS: {src.crs}")
-        for feature in src:
-            p = feature["properties"]
-            name, continent = p.get("NAME", ""), p.get("CONTINENT", "")
-            if not name or not continent:
-                skipped += 1
-                continue
-
-            iso_a2 = p.get("ISO_A2_EH", "")
-            iso_a3 = p.get("ISO_A3_EH", "")
-            iso_a2 = None if iso_a2 in ("-99", "-1", "") else iso_a2
-            iso_a3 = None if iso_a3 in ("-99", "-1", "") else iso_a3
-
-            ne_type = p.get("TYPE", "")
-            admin = p.get("ADMIN", "")
-            sovereignt = p.get("SOVEREIGNT", "")
-            sovereign = (admin == sovereignt) and ne_type not in ("Indeterminate", "Dependency", "Lease")
-
-            pop_est = p.get("POP_EST")
-            try:
-                pop_est = int(pop_est) if pop_est is not None else None
-            except (ValueError, TypeError):
-                pop_est = None
-
-            geom = shape(feature["geometry"])
-            if geom.geom_type == "Polygon":
-                geom = MultiPolygon([geom])
-            elif geom.geom_type != "MultiPolygon":
-                skipped += 1
-                continue
-
-            with conn.cursor() as cur:
-                cur.execute(insert_sql, (
+        cur.execute("TRUNCATE countries RESTART IDENTITY CASCADE")
+        with cur.copy(copy_sql) as copy:
+            for feature in src:
+                p = feature["properties"]
+                name, continent = p.get("NAME", ""), p.get("CONTINENT", "")
+                if not name or not continent:
+                    skipped += 1
+                    continue
+
+                iso_a2 = p.get("ISO_A2_EH", "")
+                iso_a3 = p.get("ISO_A3_EH", "")
+                iso_a2 = None if iso_a2 in ("-99", "-1", "") else iso_a2
+                iso_a3 = None if iso_a3 in ("-99", "-1", "") else iso_a3
+
+                ne_type = p.get("TYPE", "")
+                admin = p.get("ADMIN", "")
+                sovereignt = p.get("SOVEREIGNT", "")
+                sovereign = (admin == sovereignt) and ne_type not in ("Indeterminate", "Dependency", "Lease")
+
+                pop_est = p.get("POP_EST")
+                try:
+                    pop_est = int(pop_est) if pop_est is not None else None
+                except (ValueError, TypeError):
+                    pop_est = None
+
+                geom = shape(feature["geometry"])
+                if geom.geom_type == "Polygon":
+                    geom = MultiPolygon([geom])
+                elif geom.geom_type != "MultiPolygon":
+                    skipped += 1
+                    continue
+
+                copy.write_row((
                     iso_a2, iso_a3, name, p.get("FORMAL_EN") or None,
                     continent, p.get("REGION_UN") or None, p.get("SUBREGION") or None,
-                    ne_type or None, sovereign, pop_est, f"SRID=4326;{geom.wkt}",
+                    ne_type or None, sovereign, pop_est, wkb.dumps(geom, hex=True, srid=4326),
                 ))
-            count += 1
-            if count % 50 == 0:
-                conn.commit()
+                count += 1
 
-    conn.commit()
-    print(f"Loaded {count} countries ({skipped} skipped).")
+        conn.commit()
+        print(f"Loaded {count} countries ({skipped} skipped).")
 
-    conn.autocommit = True
-    with conn.cursor() as cur:
+        conn.autocommit = True
         cur.execute("VACUUM ANALYZE countries")
+
     conn.close()
     print("Complete.")
 